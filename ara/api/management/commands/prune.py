@@ -2,12 +2,27 @@ import logging
 import sys
 from datetime import datetime, timedelta
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
 
+from ara.api import models
 from ara.clients.utils import get_client
 
 logger = logging.getLogger(__name__)
 
+# Models holding data that belongs to a playbook, ordered from the leaves of their
+# relationships up so that no remaining row ever references a deleted one.
+PLAYBOOK_CHILDREN = (
+    models.Result,
+    models.Task,
+    models.Host,
+    models.Play,
+    models.File,
+    models.Record,
+    models.Playbook.labels.through,
+)
+
 
 class Command(BaseCommand):
     help = "Deletes playbooks from the database based on their age"
@@ -18,7 +33,8 @@ class Command(BaseCommand):
             "--client",
             type=str,
             default="offline",
-            help="API client to use for the query: 'offline' or 'http' (default: 'offline')",
+            help="API client to use for the query: 'offline' or 'http' (default: 'offline'). "
+            "The offline client deletes playbooks directly from the local database.",
         )
         parser.add_argument(
             "--endpoint",
@@ -42,6 +58,25 @@ class Command(BaseCommand):
             action="store_true",
             help="Confirm deletion of playbooks, otherwise runs without deleting any playbook",
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of playbooks deleted at once with the offline client "
+            "(default: 1000, or the maximum number of query parameters supported by the database if lower)",
+        )
+        parser.add_argument(
+            "--truncate",
+            action="store_true",
+            help="Truncate tables instead of deleting playbooks when all of them match the query, "
+            "with the offline client and PostgreSQL only",
+        )
+        parser.add_argument(
+            "--vacuum",
+            action="store_true",
+            help="Reclaim space and update statistics after deleting playbooks, "
+            "with the offline client and PostgreSQL or SQLite only",
+        )
 
     def handle(self, *args, **options):
         client = options.get("client")
@@ -52,9 +87,29 @@ class Command(BaseCommand):
         timeout = options.get("timeout")
         days = options.get("days")
         confirm = options.get("confirm")
+        batch_size = options.get("batch_size")
+        truncate = options.get("truncate")
+        vacuum = options.get("vacuum")
 
-        # Get an instance of either an offline or http client with the specified parameters.
-        # When using the offline client, don't run SQL migrations.
+        if batch_size is not None and batch_size < 1:
+            raise CommandError("--batch-size must be at least 1, got %s" % batch_size)
+
+        if not confirm:
+            logger.info("--confirm was not specified, no playbooks will be deleted")
+
+        if client == "offline":
+            # The offline client runs in the same process as the database: there is no need to
+            # go through the API one playbook at a time, delete the playbooks in bulk instead.
+            self.prune_database(days, confirm, batch_size, truncate)
+            if confirm and vacuum:
+                self.vacuum()
+        else:
+            self.prune_api(client, endpoint, username, password, insecure, timeout, days, confirm)
+
+        logger.info("%s playbooks deleted" % self.deleted)
+
+    def prune_api(self, client, endpoint, username, password, insecure, timeout, days, confirm):
+        # Get an instance of an http client with the specified parameters.
         api_client = get_client(
             client=client,
             endpoint=endpoint,
@@ -65,9 +120,6 @@ class Command(BaseCommand):
             run_sql_migrations=False,
         )
 
-        if not confirm:
-            logger.info("--confirm was not specified, no playbooks will be deleted")
-
         # generate a timestamp from n days ago in a format we can query the API with
         # ex: 2019-11-21T00:57:41.702229
         limit_date = (datetime.now() - timedelta(days=days)).isoformat()
@@ -94,4 +146,98 @@ class Command(BaseCommand):
                 api_client.delete("/api/v1/playbooks/%s" % playbook["id"])
                 self.deleted += 1
 
-        logger.info("%s playbooks deleted" % self.deleted)
+    def prune_database(self, days, confirm, batch_size, truncate):
+        limit_date = timezone.now() - timedelta(days=days)
+
+        logger.info("Querying database for playbooks started before %s" % limit_date.isoformat())
+        playbooks = models.Playbook.objects.filter(started__lte=limit_date).order_by("started")
+        playbooks = playbooks.values("id", "path", "started")
+        logger.info("Found %s playbooks matching query" % playbooks.count())
+
+        if not confirm:
+            msg = "Dry-run: playbook {id} ({path}) would have been deleted, start date: {started}"
+            for playbook in playbooks.iterator():
+                logger.info(
+                    msg.format(id=playbook["id"], path=playbook["path"], started=playbook["started"].isoformat())
+                )
+            return
+
+        if truncate:
+            if connection.vendor != "postgresql":
+                logger.info("--truncate is only supported with PostgreSQL, playbooks will be deleted in batches")
+            elif self.truncate_playbooks(playbooks):
+                return
+
+        # Every id of a batch is bound as a parameter of the delete queries, don't exceed what the
+        # database supports (i.e, 999 for SQLite before 3.32)
+        max_query_params = connection.features.max_query_params
+        if batch_size is None:
+            batch_size = min(1000, max_query_params or 1000)
+        elif max_query_params is not None and batch_size > max_query_params:
+            logger.info("Reducing batch size to %s, the maximum supported by the database" % max_query_params)
+            batch_size = max_query_params
+
+        # Delete matching playbooks in batches of a bounded size, oldest first, until none are left.
+        # This keeps memory usage and the duration of each transaction in check for large databases.
+        while True:
+            batch = list(playbooks[:batch_size])
+            if not batch:
+                break
+
+            msg = "Deleting playbook {id} ({path}), start date: {started}"
+            for playbook in batch:
+                logger.info(
+                    msg.format(id=playbook["id"], path=playbook["path"], started=playbook["started"].isoformat())
+                )
+
+            ids = [playbook["id"] for playbook in batch]
+            with transaction.atomic():
+                # Delete what belongs to the playbooks directly rather than having Django load every
+                # object in order to cascade the deletion.
+                for model in PLAYBOOK_CHILDREN:
+                    queryset = model.objects.filter(playbook_id__in=ids)
+                    queryset._raw_delete(queryset.db)
+                queryset = models.Playbook.objects.filter(pk__in=ids)
+                # Count what the statement actually deleted rather than what was selected
+                deleted = queryset._raw_delete(queryset.db)
+            self.deleted += deleted
+            logger.info("Deleted a batch of %s playbooks" % deleted)
+
+    def truncate_playbooks(self, playbooks):
+        """
+        Truncates the playbooks table and every table referencing it if all
+        playbooks match the query. Returns whether the tables were truncated.
+        """
+        table = connection.ops.quote_name(models.Playbook._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Prevent new playbooks from being recorded between the count and the truncation
+            cursor.execute("LOCK TABLE %s IN ACCESS EXCLUSIVE MODE" % table)
+            total = models.Playbook.objects.count()
+            if playbooks.count() != total:
+                logger.info("Not all playbooks match the query, playbooks will be deleted in batches")
+                return False
+
+            logger.info("Truncating tables to delete all %s playbooks" % total)
+            # CASCADE extends the truncation to the tables referencing playbooks (plays, tasks, results, etc.)
+            cursor.execute("TRUNCATE %s CASCADE" % table)
+
+        self.deleted += total
+        return True
+
+    def vacuum(self):
+        """
+        Reclaims the space left by deleted rows and updates the statistics
+        used by the query planner.
+        """
+        # VACUUM can't run inside a transaction, it relies on Django's autocommit
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                for model in PLAYBOOK_CHILDREN + (models.Playbook,):
+                    logger.info("Vacuuming table %s" % model._meta.db_table)
+                    cursor.execute("VACUUM ANALYZE %s" % connection.ops.quote_name(model._meta.db_table))
+            elif connection.vendor == "sqlite":
+                logger.info("Vacuuming database")
+                cursor.execute("VACUUM")
+                cursor.execute("ANALYZE")
+            else:
+                logger.info("--vacuum is only supported with PostgreSQL and SQLite, skipping")
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-15 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_duration_in_database'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playbook',
+            index=models.Index(fields=['started'], name='playbooks_started_idx'),
+        ),
+    ]
@@ -81,6 +81,8 @@ class Playbook(Duration):
 
     class Meta:
         db_table = "playbooks"
+        # Playbooks are pruned based on their start date
+        indexes = [models.Index(fields=["started"], name="playbooks_started_idx")]
 
     # A playbook in ARA can be running (in progress), completed (succeeded) or failed.
     UNKNOWN = "unknown"
@@ -17,6 +17,8 @@
 
 import datetime
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.utils.dateparse import parse_duration
 from rest_framework.test import APITestCase
@@ -67,6 +69,22 @@ class PlaybookTestCase(APITestCase):
         playbook = request.data["results"][0]
         self.assertEqual(playbook["ansible_version"], expected_playbook.ansible_version)
 
+    def test_get_playbooks_with_labels(self):
+        labels = [factories.LabelFactory(name="label %s" % i) for i in range(3)]
+        for _ in range(3):
+            playbook = factories.PlaybookFactory()
+            playbook.labels.set(labels)
+
+        # The labels of every playbook in the page are retrieved in a single query
+        with CaptureQueriesContext(connection) as context:
+            request = self.client.get("/api/v1/playbooks")
+        table = models.Playbook.labels.through._meta.db_table
+        label_queries = [query["sql"] for query in context.captured_queries if table in query["sql"]]
+        self.assertEqual(1, len(label_queries))
+        self.assertEqual(3, len(request.data["results"]))
+        for playbook in request.data["results"]:
+            self.assertEqual(3, len(playbook["labels"]))
+
     def test_delete_playbook(self):
         playbook = factories.PlaybookFactory()
         self.assertEqual(1, models.Playbook.objects.all().count())
@@ -1,19 +1,45 @@
 import datetime
+import logging
+import sqlite3
+from unittest import skipIf
 
 from django.contrib.auth.models import User
-from django.core.management import call_command
-from django.test import LiveServerTestCase, TestCase, override_settings
-from django.test.utils import patch_logger
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
 
 from ara.api import models
 from ara.api.tests import factories
 
 
+class ListHandler(logging.Handler):
+    """
+    Logging handler keeping the messages of the records it handles in a list
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
 def run_prune_command(*args, **opts):
-    # the command uses logging instead of prints, use patch_logger to retrieve and return the output
-    with patch_logger("ara.api.management.commands.prune", "info") as logs:
+    # the command uses logging instead of prints, capture the log records to retrieve and return the output
+    logger = logging.getLogger("ara.api.management.commands.prune")
+    handler = ListHandler()
+    level, propagate = logger.level, logger.propagate
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
         call_command("prune", *args, **opts)
-        return logs
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = propagate
+    return handler.messages
 
 
 class PruneTestCase(TestCase):
@@ -29,7 +55,7 @@ class PruneTestCase(TestCase):
         self.assertIn("0 playbooks deleted", output)
 
 
-class PruneCmdTestCase(LiveServerTestCase):
+class PruneCmdTestCase(TestCase):
     def test_prune_with_no_matching_playbook(self):
         # Create a playbook with start date as of now
         factories.PlaybookFactory()
@@ -53,6 +79,138 @@ class PruneCmdTestCase(LiveServerTestCase):
         self.assertIn("1 playbooks deleted", output)
         self.assertEqual(0, models.Playbook.objects.all().count())
 
+    def test_prune_with_matching_playbook_and_children(self):
+        # Create a playbook with an old start date and everything that can belong to it
+        old_timestamp = datetime.datetime.now() - datetime.timedelta(days=60)
+        playbook = factories.PlaybookFactory(started=old_timestamp)
+        playbook.labels.add(factories.LabelFactory())
+        play = factories.PlayFactory(playbook=playbook)
+        file = factories.FileFactory(playbook=playbook)
+        task = factories.TaskFactory(playbook=playbook, play=play, file=file)
+        host = factories.HostFactory(playbook=playbook)
+        factories.ResultFactory(playbook=playbook, play=play, task=task, host=host)
+        factories.RecordFactory(playbook=playbook)
+
+        # Create a recent playbook whose children should be left alone
+        factories.ResultFactory()
+
+        args = ["--confirm"]
+        output = run_prune_command(*args)
+        self.assertIn("Found 1 playbooks matching query", output)
+        self.assertIn("1 playbooks deleted", output)
+        self.assertFalse(models.Playbook.objects.filter(id=playbook.id).exists())
+        children = [models.Play, models.File, models.Task, models.Host, models.Result, models.Record]
+        for model in children + [models.Playbook.labels.through]:
+            self.assertEqual(0, model.objects.filter(playbook=playbook.id).count())
+        self.assertEqual(1, models.Result.objects.all().count())
+        self.assertEqual(1, models.Label.objects.all().count())
+
+    def test_prune_with_matching_playbooks_in_batches(self):
+        # Create more playbooks with an old start date than can be deleted in a single batch
+        old_timestamp = datetime.datetime.now() - datetime.timedelta(days=60)
+        models.Playbook.objects.bulk_create(factories.PlaybookFactory.build_batch(3, started=old_timestamp))
+        self.assertEqual(3, models.Playbook.objects.all().count())
+
+        args = ["--confirm", "--batch-size", "2"]
+        output = run_prune_command(*args)
+        self.assertIn("Found 3 playbooks matching query", output)
+        self.assertIn("Deleted a batch of 2 playbooks", output)
+        self.assertIn("Deleted a batch of 1 playbooks", output)
+        self.assertIn("3 playbooks deleted", output)
+        self.assertEqual(0, models.Playbook.objects.all().count())
+
+    def test_prune_with_more_playbooks_than_query_parameters(self):
+        # Create more playbooks with an old start date than the default batch size (and SQLite's
+        # limit on query parameters), they must still be deleted with the default batch size
+        old_timestamp = datetime.datetime.now() - datetime.timedelta(days=60)
+        models.Playbook.objects.bulk_create(factories.PlaybookFactory.build_batch(1001, started=old_timestamp))
+        self.assertEqual(1001, models.Playbook.objects.all().count())
+
+        # SQLite 3.32 raised its limit, enforce the one Django expects (requires python >= 3.11)
+        if connection.vendor == "sqlite" and hasattr(connection.connection, "setlimit"):
+            limit = connection.connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+            self.addCleanup(connection.connection.setlimit, sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, limit)
+
+        args = ["--confirm"]
+        output = run_prune_command(*args)
+        self.assertIn("Found 1001 playbooks matching query", output)
+        # The default batch size is quietly lowered to what the database supports
+        batch_size = min(1000, connection.features.max_query_params or 1000)
+        self.assertIn("Deleted a batch of %s playbooks" % batch_size, output)
+        self.assertFalse([line for line in output if line.startswith("Reducing batch size")])
+        self.assertIn("1001 playbooks deleted", output)
+        self.assertEqual(0, models.Playbook.objects.all().count())
+
+    @skipIf(connection.features.max_query_params is None, "The database has no limit on query parameters")
+    def test_prune_with_batch_size_above_query_parameters(self):
+        # Create a playbook with an old start date
+        old_timestamp = datetime.datetime.now() - datetime.timedelta(days=60)
+        factories.PlaybookFactory(started=old_timestamp)
+        self.assertEqual(1, models.Playbook.objects.all().count())
+
+        max_query_params = connection.features.max_query_params
+        args = ["--confirm", "--batch-size", str(max_query_params + 1)]
+        output = run_prune_command(*args)
+        self.assertIn("Reducing batch size to %s, the maximum supported by the database" % max_query_params, output)
+        self.assertIn("1 playbooks deleted", output)
+        self.assertEqual(0, models.Playbook.objects.all().count())
+
+    def test_prune_with_invalid_batch_size(self):
+        for batch_size in ["0", "-1"]:
+            with self.assertRaises(CommandError):
+                run_prune_command("--confirm", "--batch-size", batch_size)
+
+    @skipIf(connection.vendor == "postgresql", "Truncating is supported with PostgreSQL")
+    def test_prune_with_truncate_without_postgresql(self):
+        # Create a playbook with an old start date
+        old_timestamp = datetime.datetime.now() - datetime.timedelta(days=60)
+        factories.PlaybookFactory(started=old_timestamp)
+        self.assertEqual(1, models.Playbook.objects.all().count())
+
+        # Truncating is only supported with PostgreSQL, playbooks are deleted as usual otherwise
+        args = ["--confirm", "--truncate"]
+        output = run_prune_command(*args)
+        self.assertIn("--truncate is only supported with PostgreSQL, playbooks will be deleted in batches", output)
+        self.assertIn("1 playbooks deleted", output)
+        self.assertEqual(0, models.Playbook.objects.all().count())
+
+    def test_prune_dry_run_with_matching_playbook(self):
+        # Create a playbook with an old start date
+        old_timestamp = datetime.datetime.now() - datetime.timedelta(days=60)
+        playbook = factories.PlaybookFactory(started=old_timestamp)
+        self.assertEqual(1, models.Playbook.objects.all().count())
+
+        output = run_prune_command()
+        self.assertIn("Found 1 playbooks matching query", output)
+        # Compare with the start date as it was stored in the database
+        playbook.refresh_from_db()
+        msg = "Dry-run: playbook {id} ({path}) would have been deleted, start date: {started}"
+        self.assertIn(msg.format(id=playbook.id, path=playbook.path, started=playbook.started.isoformat()), output)
+        self.assertIn("0 playbooks deleted", output)
+        self.assertEqual(1, models.Playbook.objects.all().count())
+
+
+class PruneCmdVacuumTestCase(TransactionTestCase):
+    # VACUUM can't run inside the transaction a TestCase wraps tests in
+    def test_prune_with_vacuum(self):
+        # Create a playbook with an old start date
+        old_timestamp = datetime.datetime.now() - datetime.timedelta(days=60)
+        factories.PlaybookFactory(started=old_timestamp)
+        self.assertEqual(1, models.Playbook.objects.all().count())
+
+        args = ["--confirm", "--vacuum"]
+        output = run_prune_command(*args)
+        self.assertIn("1 playbooks deleted", output)
+        if connection.vendor == "postgresql":
+            self.assertIn("Vacuuming table %s" % models.Playbook._meta.db_table, output)
+        elif connection.vendor == "sqlite":
+            self.assertIn("Vacuuming database", output)
+        else:
+            self.assertIn("--vacuum is only supported with PostgreSQL and SQLite, skipping", output)
+        self.assertEqual(0, models.Playbook.objects.all().count())
+
+
+class PruneCmdHttpTestCase(LiveServerTestCase):
     def test_prune_with_no_matching_playbook_with_http_client(self):
         # Create a playbook with start date as of now
         factories.PlaybookFactory()
@@ -40,8 +40,14 @@ class PlaybookViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         statuses = self.request.GET.getlist("status")
         if statuses:
-            return models.Playbook.objects.filter(status__in=statuses)
-        return models.Playbook.objects.all()
+            queryset = models.Playbook.objects.filter(status__in=statuses)
+        else:
+            queryset = models.Playbook.objects.all()
+
+        if self.action == "list":
+            # Retrieve the labels of every playbook in the page at once instead of one query per playbook
+            queryset = queryset.prefetch_related("labels")
+        return queryset
 
     def get_serializer_class(self):
         if self.action == "list":